@@ -1,41 +1,114 @@
 #!/usr/bin/env python3
-"""Analyze Context Lens session data and produce summary statistics."""
+"""Analyze Context Lens session data and produce summary statistics.
+
+Runs on any CPython 3 with only the stdlib; orjson and numpy are picked
+up when installed. The per-block analysis loop is interpreter-bound, so
+for very large fleets the script also runs unmodified (and considerably
+faster) under PyPy: `pypy3 analyze-sessions.py`.
+"""
 
 import json
 import glob
+import mmap
 import os
+import statistics
 import sys
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import orjson
+
+    def _json_loads(s):
+        return orjson.loads(s)
+except ImportError:
+    def _json_loads(s):
+        return json.loads(s)
+
+def _approx_len(x):
+    """Approximate serialized length without actually encoding.
+
+    Exactness doesn't matter: block lengths are only used as relative
+    weights when distributing message tokens across blocks.
+    """
+    if isinstance(x, str):
+        return len(x)
+    if isinstance(x, (int, float, bool)):
+        return 8
+    if isinstance(x, list):
+        return sum(_approx_len(v) for v in x)
+    if isinstance(x, dict):
+        return sum(len(k) + _approx_len(v) for k, v in x.items())
+    return 0
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
 
+# Category slots: categorize_block returns an index into a fixed-size
+# list, so the per-block hot loop does one list write instead of a dict
+# hash-and-store. The names expand back to dict keys in the result.
+_CATEGORY_NAMES = (
+    "thinking", "tool_calls", "tool_results",
+    "user_text", "assistant_text", "other",
+)
+_THINKING, _TOOL_CALLS, _TOOL_RESULTS, _USER_TEXT, _ASSISTANT_TEXT, _OTHER = range(6)
+
+# Dispatch tables for categorize_block: one dict lookup instead of a
+# chain of comparisons, since it runs once per block.
+_BLOCK_CATEGORIES = {
+    "thinking": _THINKING,
+    "tool_use": _TOOL_CALLS,
+    "tool_result": _TOOL_RESULTS,
+}
+_TEXT_CATEGORIES = {
+    "user": _USER_TEXT,
+    "assistant": _ASSISTANT_TEXT,
+}
+
 def categorize_block(role, block_type):
-    if block_type == "thinking":
-        return "thinking"
-    if block_type == "tool_use":
-        return "tool_calls"
-    if block_type == "tool_result":
-        return "tool_results"
-    if role == "user" and block_type == "text":
-        return "user_text"
-    if role == "assistant" and block_type == "text":
-        return "assistant_text"
-    return "other"
+    if block_type == "text":
+        return _TEXT_CATEGORIES.get(role, _OTHER)
+    return _BLOCK_CATEGORIES.get(block_type, _OTHER)
 
 def analyze_session(filepath):
     """Analyze the last request in a session (represents full context)."""
-    last_line = None
-    num_requests = 0
-    with open(filepath) as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                last_line = line
+    if os.stat(filepath).st_size == 0:
+        return None
+
+    # Only the final line matters, so don't stream the whole file through
+    # Python: mmap it, count newlines in C, and slice out the last line.
+    with open(filepath, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # mmap has no count(); scan with find() so the byte search
+            # stays in C and no per-line str is allocated.
+            num_requests = 0
+            pos = mm.find(b"\n")
+            while pos != -1:
                 num_requests += 1
+                pos = mm.find(b"\n", pos + 1)
+            num_requests = num_requests or 1
+            # Walk back line by line to the last non-blank line, like the
+            # old line-by-line reader did, without reading the whole file.
+            end = len(mm)
+            last_line = b""
+            while end > 0:
+                while end > 0 and mm[end - 1] in (0x0A, 0x0D):
+                    end -= 1
+                if end == 0:
+                    break
+                start = mm.rfind(b"\n", 0, end) + 1
+                last_line = mm[start:end].strip()
+                if last_line:
+                    break
+                end = start  # whitespace-only line; keep walking back
 
     if not last_line:
         return None
 
-    data = json.loads(last_line)
+    data = _json_loads(last_line)
     ci = data.get("contextInfo", {})
 
     model = ci.get("model", "unknown")
@@ -44,15 +117,8 @@ def analyze_session(filepath):
     tools_tokens = ci.get("toolsTokens", 0)
     messages_tokens = ci.get("messagesTokens", 0)
 
-    # Break down message tokens by type
-    categories = {
-        "thinking": 0,
-        "tool_calls": 0,
-        "tool_results": 0,
-        "user_text": 0,
-        "assistant_text": 0,
-        "other": 0,
-    }
+    # Break down message tokens by type, one slot per category
+    categories = [0] * len(_CATEGORY_NAMES)
 
     # We need to estimate per-block tokens from the messages
     # Context Lens stores per-message tokens but not always per-block
@@ -71,34 +137,29 @@ def analyze_session(filepath):
                 # Could be tool_result or user text; check content
                 content = msg.get("content", "")
                 if "tool_result" in str(content):
-                    categories["tool_results"] += msg_tokens
+                    categories[_TOOL_RESULTS] += msg_tokens
                 else:
-                    categories["user_text"] += msg_tokens
+                    categories[_USER_TEXT] += msg_tokens
             elif role == "assistant":
-                categories["assistant_text"] += msg_tokens
+                categories[_ASSISTANT_TEXT] += msg_tokens
             total_categorized += msg_tokens
             continue
 
         # Estimate token distribution across blocks by text length
         block_lengths = []
         for b in blocks:
-            text = b.get("text", "") or ""
+            blen = len(b.get("text", "") or "")
             # tool_use and tool_result might have other fields
             if b.get("type") == "tool_use":
-                inp = json.dumps(b.get("input", {})) if b.get("input") else ""
-                text = b.get("name", "") + inp
+                blen = len(b.get("name", "")) + _approx_len(b.get("input"))
             if b.get("type") == "tool_result":
-                content = b.get("content", "")
-                if isinstance(content, list):
-                    text = json.dumps(content)
-                elif isinstance(content, str):
-                    text = content
-            block_lengths.append(len(text))
+                blen = _approx_len(b.get("content", ""))
+            block_lengths.append(blen)
 
         total_len = sum(block_lengths) or 1
         for b, blen in zip(blocks, block_lengths):
             cat = categorize_block(role, b.get("type", "text"))
-            estimated_tokens = int(msg_tokens * blen / total_len)
+            estimated_tokens = msg_tokens * blen // total_len
             categories[cat] += estimated_tokens
             total_categorized += estimated_tokens
 
@@ -113,9 +174,16 @@ def analyze_session(filepath):
         "system_tokens": system_tokens,
         "tools_tokens": tools_tokens,
         "messages_tokens": messages_tokens,
-        **categories,
+        **dict(zip(_CATEGORY_NAMES, categories)),
     }
 
+def _analyze_safe(filepath):
+    """Run analyze_session, returning errors as values so they survive a process pool."""
+    try:
+        return filepath, analyze_session(filepath), None
+    except Exception as e:
+        return filepath, None, str(e)
+
 def fmt_pct(val, total):
     if total == 0:
         return "0%"
@@ -168,9 +236,37 @@ def print_aggregate(sessions):
         "user_text": 0, "other": 0, "total_tokens": 0,
     }
     
-    for s in big:
+    # One pass over the sessions: accumulate sums and collect the
+    # per-session values the Min/Max/Median table needs below.
+    # With numpy, store columns as int64 arrays and vectorize instead.
+    if np is not None:
+        cols = {
+            k: np.fromiter((s[k] for s in big), dtype=np.int64, count=len(big))
+            for k in totals
+        }
         for k in totals:
-            totals[k] += s[k]
+            totals[k] = int(cols[k].sum())
+        t = cols["total_tokens"]
+        nz = t > 0
+        tot_vals = t
+        tr_pcts = cols["tool_results"][nz] / t[nz] * 100
+        th_pcts = cols["thinking"][nz] / t[nz] * 100
+        ut_pcts = cols["user_text"][nz] / t[nz] * 100
+    else:
+        tot_vals = []
+        tr_pcts = []
+        th_pcts = []
+        ut_pcts = []
+
+        for s in big:
+            for k in totals:
+                totals[k] += s[k]
+            t = s["total_tokens"]
+            tot_vals.append(t)
+            if t > 0:
+                tr_pcts.append(s["tool_results"] / t * 100)
+                th_pcts.append(s["thinking"] / t * 100)
+                ut_pcts.append(s["user_text"] / t * 100)
 
     grand = totals["total_tokens"]
     print(f"Combined tokens: {grand:,}")
@@ -195,21 +291,23 @@ def print_aggregate(sessions):
     print(f"\n{'Metric':<25} {'Min':>8} {'Max':>8} {'Median':>8}")
     print(f"{'-'*51}")
     
-    for label, key in [("Total tokens", "total_tokens"), ("Tool results %", None), ("Thinking %", None), ("User text %", None)]:
-        if key:
-            vals = sorted([s[key] for s in big])
-        elif "Tool results" in label:
-            vals = sorted([s["tool_results"] / s["total_tokens"] * 100 for s in big if s["total_tokens"] > 0])
-        elif "Thinking" in label:
-            vals = sorted([s["thinking"] / s["total_tokens"] * 100 for s in big if s["total_tokens"] > 0])
-        elif "User text" in label:
-            vals = sorted([s["user_text"] / s["total_tokens"] * 100 for s in big if s["total_tokens"] > 0])
-        
-        mid = vals[len(vals)//2]
-        if key == "total_tokens":
-            print(f"{label:<25} {vals[0]:>7,} {vals[-1]:>7,} {mid:>7,}")
+    for label, vals, is_tokens in [
+        ("Total tokens", tot_vals, True),
+        ("Tool results %", tr_pcts, False),
+        ("Thinking %", th_pcts, False),
+        ("User text %", ut_pcts, False),
+    ]:
+        # median_high (and percentile method="higher") matches the old
+        # sorted()[n//2] selection exactly
+        if np is not None:
+            mn, mx = vals.min(), vals.max()
+            mid = np.percentile(vals, 50, method="higher")
         else:
-            print(f"{label:<25} {vals[0]:>7.1f}% {vals[-1]:>7.1f}% {mid:>7.1f}%")
+            mn, mx, mid = min(vals), max(vals), statistics.median_high(vals)
+        if is_tokens:
+            print(f"{label:<25} {mn:>7,} {mx:>7,} {mid:>7,}")
+        else:
+            print(f"{label:<25} {mn:>7.1f}% {mx:>7.1f}% {mid:>7.1f}%")
 
 def main():
     pattern = os.path.join(DATA_DIR, "claude-*.jsonl")
@@ -221,14 +319,20 @@ def main():
     
     print(f"Found {len(files)} session files")
     
+    # Sessions are independent and CPU-bound on JSON parsing, so analyze
+    # them one worker per core. Skip the fork overhead for a handful.
+    if len(files) >= 8:
+        with ProcessPoolExecutor() as ex:
+            results = list(ex.map(_analyze_safe, files, chunksize=4))
+    else:
+        results = [_analyze_safe(f) for f in files]
+
     sessions = []
-    for f in files:
-        try:
-            result = analyze_session(f)
-            if result:
-                sessions.append(result)
-        except Exception as e:
-            print(f"Error processing {f}: {e}", file=sys.stderr)
+    for f, result, error in results:
+        if error:
+            print(f"Error processing {f}: {error}", file=sys.stderr)
+        elif result:
+            sessions.append(result)
     
     # Print individual sessions (sorted by total tokens)
     for s in sorted(sessions, key=lambda x: -x["total_tokens"]):
@@ -23,10 +23,41 @@ Environment variables:
 
 import json
 import os
+import queue
+import re
+import threading
 import time
-import urllib.request
+# Import the classes directly: `from mitmproxy import http` below shadows
+# the stdlib http package.
+from http.client import HTTPConnection, HTTPSConnection
+from urllib.parse import urlsplit
 from mitmproxy import http
 
+try:
+    import orjson
+
+    def _json_loads(data):
+        return orjson.loads(data)
+
+    def _json_dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+
+    # orjson.Fragment (3.9+) embeds already-serialized JSON verbatim.
+    _Fragment = getattr(orjson, "Fragment", None)
+
+    def _json_passthrough(raw: bytes, parsed):
+        # Embed already-serialized JSON in a capture without re-encoding it.
+        return _Fragment(raw) if _Fragment is not None else parsed
+except ImportError:
+    def _json_loads(data):
+        return json.loads(data)
+
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+
+    def _json_passthrough(raw: bytes, parsed):
+        return parsed
+
 # WebSocket state: keyed by flow id, stores pending request bodies
 # so we can pair response.create (client) with response.completed (server).
 _ws_pending: dict[str, dict] = {}
@@ -76,35 +107,131 @@ CATCHALL_PATH_PATTERNS = [
     ("/v1/responses", "openai"),
 ]
 
+# Precompiled single-scan index over the pattern tables, built once at
+# import. match_request is on the hot path for every proxied request, so
+# instead of running one substring check per pattern, a compiled regex
+# alternation finds the matching host in one scan and leaves only that
+# host's one or two path patterns to check.
+_PATTERNS_BY_HOST: dict[str, list] = {}
+for _host, _path, _provider, _source in CAPTURE_PATTERNS:
+    _PATTERNS_BY_HOST.setdefault(_host, []).append((_path, _provider, _source))
+_HOST_RE = re.compile("|".join(re.escape(h) for h in _PATTERNS_BY_HOST))
+_CATCHALL_RE = re.compile(
+    "|".join(f"({re.escape(p)})" for p, _ in CATCHALL_PATH_PATTERNS)
+)
+
+# Headers safe to capture (no auth tokens). Frozensets give O(1) lookup
+# per header instead of scanning a tuple rebuilt on every request.
+_SAFE_REQUEST_HEADERS = frozenset({
+    "content-type", "content-encoding", "accept", "user-agent",
+    "anthropic-version", "openai-beta", "x-request-id",
+})
+_SAFE_RESPONSE_HEADERS = frozenset({
+    "content-type", "x-request-id", "x-ratelimit-limit-requests",
+    "x-ratelimit-remaining-requests", "x-ratelimit-limit-tokens",
+    "x-ratelimit-remaining-tokens", "openai-processing-ms",
+    "anthropic-ratelimit-requests-limit",
+    "anthropic-ratelimit-requests-remaining",
+})
+
+
+# Ingest posts happen off the proxy event loop: captures are enqueued and
+# a daemon worker POSTs them, so a slow ingest server never stalls proxied
+# traffic. The queue is bounded; bursts beyond it are dropped with a log line.
+_ingest_queue: queue.Queue = queue.Queue(maxsize=1024)
+_ingest_worker_started = False
+_ingest_lock = threading.Lock()
+
+
+def _ingest_worker():
+    # Keep one TCP connection to the ingest server alive across posts
+    # instead of a fresh connect/teardown per capture. Only this thread
+    # touches the connection, so no locking is needed.
+    url = urlsplit(INGEST_URL)
+    conn_cls = HTTPSConnection if url.scheme == "https" else HTTPConnection
+    conn = None
+    while True:
+        payload, log_line = _ingest_queue.get()
+        for attempt in (0, 1):
+            try:
+                if conn is None:
+                    conn = conn_cls(url.hostname, url.port, timeout=5)
+                conn.request(
+                    "POST", url.path or "/", payload,
+                    {"Content-Type": "application/json"},
+                )
+                # Drain the response so the socket can be reused.
+                conn.getresponse().read()
+                print(log_line)
+                break
+            except Exception as e:
+                # A stale keep-alive socket surfaces here; reconnect once.
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                conn = None
+                if attempt:
+                    print(f"[context-lens] Failed to ingest: {e}")
+
+
+def _enqueue_ingest(payload: bytes, log_line: str):
+    """Queue a capture for the background ingest worker, starting it lazily."""
+    global _ingest_worker_started
+    if not _ingest_worker_started:
+        with _ingest_lock:
+            if not _ingest_worker_started:
+                threading.Thread(target=_ingest_worker, daemon=True).start()
+                _ingest_worker_started = True
+    try:
+        _ingest_queue.put_nowait((payload, log_line))
+    except queue.Full:
+        print("[context-lens] Ingest queue full, dropping capture")
+
+
+# Captures arriving within the same second share one formatted timestamp.
+_ts_cache = (0, "")
+
+
+def _iso_now() -> str:
+    """Current UTC time in the capture timestamp format, cached per second."""
+    global _ts_cache
+    t = int(time.time())
+    if t != _ts_cache[0]:
+        _ts_cache = (t, time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(t)))
+    return _ts_cache[1]
+
 
 def match_request(flow: http.HTTPFlow):
     """Check if this request matches a known LLM API pattern."""
     host = flow.request.pretty_host
     path = flow.request.path
-    for host_pat, path_pat, provider, source in CAPTURE_PATTERNS:
-        if host_pat in host and path_pat in path:
-            # CLI-provided tool name overrides per-pattern source so all
-            # traffic in this mitmproxy session is attributed to the same tool.
-            return provider, CONTEXT_LENS_SOURCE or source
+    for m in _HOST_RE.finditer(host):
+        for path_pat, provider, source in _PATTERNS_BY_HOST[m.group()]:
+            if path_pat in path:
+                # CLI-provided tool name overrides per-pattern source so all
+                # traffic in this mitmproxy session is attributed to the same tool.
+                return provider, CONTEXT_LENS_SOURCE or source
     # Fall back to catch-all path matching for OpenAI-compatible providers
-    for path_pat, provider in CATCHALL_PATH_PATTERNS:
-        if path_pat in path:
-            source = CONTEXT_LENS_SOURCE or (host.split(".")[0] if "." in host else host)
-            return provider, source
+    m = _CATCHALL_RE.search(path)
+    if m:
+        provider = CATCHALL_PATH_PATTERNS[m.lastindex - 1][1]
+        source = CONTEXT_LENS_SOURCE or (host.split(".")[0] if "." in host else host)
+        return provider, source
     return None, None
 
 
+# One scan over the path instead of one substring check per format.
+_API_FORMAT_RE = re.compile(
+    r"(/backend-api/)|(/chat/completions)|(/v1/messages)|(/responses)"
+)
+_API_FORMATS = ("responses", "chat-completions", "anthropic-messages", "responses")
+
+
 def _detect_api_format(path: str) -> str:
     """Detect API format from the request path."""
-    if "/backend-api/" in path:
-        return "responses"
-    if "/responses" in path:
-        return "responses"
-    if "/chat/completions" in path:
-        return "chat-completions"
-    if "/v1/messages" in path:
-        return "anthropic-messages"
-    return "unknown"
+    m = _API_FORMAT_RE.search(path)
+    return _API_FORMATS[m.lastindex - 1] if m else "unknown"
 
 
 def _resolve_session_id(flow: http.HTTPFlow):
@@ -147,8 +274,8 @@ def websocket_message(flow: http.HTTPFlow):
     assert flow.websocket is not None
     msg = flow.websocket.messages[-1]
     try:
-        data = json.loads(msg.text or msg.content)
-    except (json.JSONDecodeError, TypeError):
+        data = _json_loads(msg.text or msg.content)
+    except (ValueError, TypeError):
         return
 
     msg_type = data.get("type", "")
@@ -166,10 +293,11 @@ def websocket_message(flow: http.HTTPFlow):
 
         response_obj = data.get("response", {})
         source = CONTEXT_LENS_SOURCE or "codex"
+        response_bytes = _json_dumps(response_obj)
 
         # Build a synthetic capture matching the HTTP ingest format.
         capture = {
-            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+            "timestamp": _iso_now(),
             "method": "POST",
             "path": flow.request.path,
             "source": source,
@@ -178,12 +306,12 @@ def websocket_message(flow: http.HTTPFlow):
             "targetUrl": flow.request.pretty_url,
             "requestHeaders": {},
             "requestBody": request_data,
-            "requestBytes": len(json.dumps(request_data)),
+            "requestBytes": len(_json_dumps(request_data)),
             "responseStatus": 200,
             "responseHeaders": {"content-type": "application/json"},
-            "responseBody": json.dumps(response_obj),
+            "responseBody": response_bytes.decode(),
             "responseIsStreaming": False,
-            "responseBytes": len(json.dumps(response_obj)),
+            "responseBytes": len(response_bytes),
             "sessionId": _resolve_session_id(flow),
             "timings": {
                 "send_ms": 0,
@@ -193,18 +321,12 @@ def websocket_message(flow: http.HTTPFlow):
             },
         }
 
-        payload = json.dumps(capture).encode()
-        try:
-            req = urllib.request.Request(
-                INGEST_URL,
-                data=payload,
-                headers={"Content-Type": "application/json"},
-            )
-            urllib.request.urlopen(req, timeout=5)
-            model = request_data.get("model", "unknown")
-            print(f"[context-lens] Captured WS {source}/codex request (model={model})")
-        except Exception as e:
-            print(f"[context-lens] Failed to ingest WS capture: {e}")
+        payload = _json_dumps(capture)
+        model = request_data.get("model", "unknown")
+        _enqueue_ingest(
+            payload,
+            f"[context-lens] Captured WS {source}/codex request (model={model})",
+        )
 
 
 def response(flow: http.HTTPFlow):
@@ -216,26 +338,34 @@ def response(flow: http.HTTPFlow):
     if not provider:
         return
 
-    # Parse request body (mitmproxy auto-decompresses zstd/gzip)
+    # Parse request body (mitmproxy auto-decompresses zstd/gzip). The parse
+    # validates the body and gives us the model name; the capture embeds the
+    # raw bytes as a pre-serialized fragment so the chat history is never
+    # re-encoded on the way to the ingest server.
     try:
-        request_text = flow.request.get_text()
-        request_body = json.loads(request_text)
-    except (json.JSONDecodeError, ValueError, Exception) as e:
+        # .content raises ValueError on undecodable content-encoding
+        raw_req = flow.request.content or b""
+        request_body = _json_loads(raw_req)
+    except Exception as e:
         print(f"[context-lens] Could not parse request body: {e}")
         return
 
-    # Get response body (may be JSON or SSE event stream)
+    # Get response body (may be JSON or SSE event stream). Work on the
+    # decompressed bytes and decode at most once — get_text() would decode
+    # MB-sized SSE streams even when the body turns out to be binary.
     response_body = ""
     response_is_streaming = False
+    raw_resp = b""
     try:
-        response_text = flow.response.get_text()
+        raw_resp = flow.response.content or b""
         content_type = flow.response.headers.get("content-type", "")
 
-        if "text/event-stream" in content_type or response_text.startswith("event:"):
-            response_body = response_text
+        if "text/event-stream" in content_type or raw_resp.startswith(b"event:"):
+            response_body = raw_resp.decode("utf-8", "replace")
             response_is_streaming = True
-        else:
-            response_body = response_text
+        elif "json" in content_type or "text" in content_type or not content_type:
+            response_body = raw_resp.decode("utf-8", "replace")
+        # Other content types (octet-stream etc.) are left uncaptured.
     except Exception as e:
         print(f"[context-lens] Could not read response body: {e}")
         response_body = ""
@@ -244,26 +374,17 @@ def response(flow: http.HTTPFlow):
     api_format = _detect_api_format(flow.request.path)
 
     # Select safe headers (no auth tokens)
-    safe_request_headers = {}
-    for k, v in flow.request.headers.items():
-        lower = k.lower()
-        if lower in ("content-type", "content-encoding", "accept",
-                      "user-agent", "anthropic-version", "openai-beta",
-                      "x-request-id"):
-            safe_request_headers[k] = v
-
-    safe_response_headers = {}
-    for k, v in flow.response.headers.items():
-        lower = k.lower()
-        if lower in ("content-type", "x-request-id", "x-ratelimit-limit-requests",
-                      "x-ratelimit-remaining-requests", "x-ratelimit-limit-tokens",
-                      "x-ratelimit-remaining-tokens", "openai-processing-ms",
-                      "anthropic-ratelimit-requests-limit",
-                      "anthropic-ratelimit-requests-remaining"):
-            safe_response_headers[k] = v
+    safe_request_headers = {
+        k: v for k, v in flow.request.headers.items()
+        if k.lower() in _SAFE_REQUEST_HEADERS
+    }
+    safe_response_headers = {
+        k: v for k, v in flow.response.headers.items()
+        if k.lower() in _SAFE_RESPONSE_HEADERS
+    }
 
     capture = {
-        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+        "timestamp": _iso_now(),
         "method": "POST",
         "path": flow.request.path,
         "source": source,
@@ -271,13 +392,13 @@ def response(flow: http.HTTPFlow):
         "apiFormat": api_format,
         "targetUrl": flow.request.pretty_url,
         "requestHeaders": safe_request_headers,
-        "requestBody": request_body,
-        "requestBytes": len(flow.request.raw_content),
+        "requestBody": _json_passthrough(raw_req, request_body),
+        "requestBytes": len(raw_req),
         "responseStatus": flow.response.status_code,
         "responseHeaders": safe_response_headers,
         "responseBody": response_body,
         "responseIsStreaming": response_is_streaming,
-        "responseBytes": len(flow.response.raw_content),
+        "responseBytes": len(raw_resp),
         "sessionId": _resolve_session_id(flow),
         "timings": {
             "send_ms": 0,
@@ -288,16 +409,9 @@ def response(flow: http.HTTPFlow):
         },
     }
 
-    payload = json.dumps(capture).encode()
-
-    try:
-        req = urllib.request.Request(
-            INGEST_URL,
-            data=payload,
-            headers={"Content-Type": "application/json"},
-        )
-        urllib.request.urlopen(req, timeout=5)
-        model = request_body.get("model", "unknown")
-        print(f"[context-lens] Captured {source}/{provider} request (model={model})")
-    except Exception as e:
-        print(f"[context-lens] Failed to ingest: {e}")
+    payload = _json_dumps(capture)
+    model = request_body.get("model", "unknown")
+    _enqueue_ingest(
+        payload,
+        f"[context-lens] Captured {source}/{provider} request (model={model})",
+    )